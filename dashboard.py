@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core.exceptions import FailedPrecondition
 import plotly.express as px
 import datetime
 import os
@@ -10,6 +11,9 @@ import os
 PAGE_TITLE = "Smart Access Control System"
 COLLECTION_NAME = "security_logs"
 GCP_KEY_PATH = "serviceAccountKey.json"
+LOG_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"  # datetime_str format written by the gateway
+BATCH_LIMIT = 500  # Max operations per Firestore batched write
+LOG_FIELDS = ["datetime_str", "timestamp", "name", "status", "image_url"]  # Only fields the dashboard reads
 
 # --- INITIALIZATION ---
 st.set_page_config(
@@ -55,7 +59,10 @@ if not st.session_state["authenticated"]:
 st.success("✅ Authenticated as Admin")
 
 
-@st.cache_resource
+# One Firestore client (and gRPC channel) for the app's lifetime; a failed
+# init (None) is retried on the next run. Only st.cache_resource.clear()
+# forces a rebuild.
+@st.cache_resource(ttl=None, show_spinner=False, validate=lambda client: client is not None)
 def get_db():
     try:
         # Check if already initialized
@@ -75,39 +82,124 @@ def get_db():
 db = get_db()
 
 # --- DATA LOADING ---
+def parse_log_times(times):
+    """Parse log times to naive local datetime64.
+    datetime_str values are naive local-time strings, but legacy docs fall back to
+    the tz-aware Firestore timestamp, which is converted to naive local time first
+    (pandas can't parse a mix of naive and tz-aware values)."""
+    times = times.astype(object)
+    times = times.where(times.notna(), datetime.datetime.now())
+    times = times.map(lambda t: t.astimezone().replace(tzinfo=None)
+                      if isinstance(t, datetime.datetime) and t.tzinfo else t)
+    return pd.to_datetime(times, format=LOG_TIME_FORMAT, errors="coerce")
+
+# Cached so widget clicks don't re-read Firestore; the Refresh button and
+# delete_logs clear this via st.cache_data.clear()
+@st.cache_data(ttl=30, show_spinner=False)
 def load_data():
     """Load security logs from Firestore with document IDs."""
     if not db: return pd.DataFrame()
     
-    docs = db.collection(COLLECTION_NAME).order_by("timestamp", direction=firestore.Query.DESCENDING).limit(100).stream()
+    docs = db.collection(COLLECTION_NAME).select(LOG_FIELDS).order_by("timestamp", direction=firestore.Query.DESCENDING).limit(100).stream()
     
-    data = []
-    for doc in docs:
+    records = [{**doc.to_dict(), "DocID": doc.id} for doc in docs]
+    if not records: return pd.DataFrame()
+
+    # Build column-wise; reindex so fields absent from every doc still exist
+    raw = pd.DataFrame.from_records(records).reindex(
+        columns=["DocID", *LOG_FIELDS])
+
+    # Handle different timestamp formats if legacy data exists
+    # (fallback to server timestamp, then to now)
+    ts = raw["datetime_str"].astype(object)
+    ts = ts.where(ts.notna(), raw["timestamp"])
+    # Parse once here (cached) rather than on every chart render
+    ts = parse_log_times(ts)
+    image = raw["image_url"].astype(object)
+
+    return pd.DataFrame({
+        "DocID": raw["DocID"],  # Store document ID for deletion
+        "Time": ts,
+        "Name": raw["name"].fillna("Unknown"),
+        "Status": raw["status"].fillna("Unknown"),
+        "Image": image.where(image.notna(), None)
+    })
+
+# --- GALLERY LOADING ---
+def intruder_query():
+    """Intruder logs, newest first (needs the composite index in firestore.indexes.json)."""
+    return db.collection(COLLECTION_NAME).where("status", "==", "Intruder").order_by("timestamp", direction=firestore.Query.DESCENDING)
+
+@st.cache_data(ttl=30, show_spinner=False)
+def load_intruder_count():
+    """Count intruder logs server-side without reading the documents.
+    Returns None if the composite index is missing; caching that result keeps
+    reruns from re-sending a failing query until the TTL expires."""
+    if not db: return 0
+    try:
+        return intruder_query().count().get()[0][0].value
+    except FailedPrecondition:
+        return None
+
+@st.cache_data(ttl=30, show_spinner=False)
+def load_intruder_page(cursor_id, page_size):
+    """Load one gallery page of intruder logs, starting after the cursor document.
+    Returns None if the cursor document has since been deleted."""
+    if not db: return pd.DataFrame(columns=["DocID", "Time", "Image"])
+
+    query = intruder_query().select(LOG_FIELDS)
+    if cursor_id:
+        cursor = db.collection(COLLECTION_NAME).document(cursor_id).get()
+        if not cursor.exists:
+            return None
+        query = query.start_after(cursor)
+
+    rows = []
+    for doc in query.limit(page_size).stream():
         d = doc.to_dict()
-        # Handle different timestamp formats if legacy data exists
-        if "datetime_str" in d:
-            ts = d["datetime_str"]
-        else:
-            # Fallback to server timestamp conversion
-            ts = d.get("timestamp", datetime.datetime.now())
-            
-        data.append({
-            "DocID": doc.id,  # Store document ID for deletion
-            "Time": ts,
-            "Name": d.get("name", "Unknown"),
-            "Status": d.get("status", "Unknown"),
-            "Image": d.get("image_url", None)
+        rows.append({
+            "DocID": doc.id,
+            "Time": d.get("datetime_str", d.get("timestamp")),
+            "Image": d.get("image_url")
         })
-    
-    return pd.DataFrame(data)
+    page = pd.DataFrame(rows, columns=["DocID", "Time", "Image"])
+    page["Time"] = parse_log_times(page["Time"])  # Same parsing as load_data
+    return page
+
+def reset_gallery():
+    """Restart gallery pagination from the newest log (cursors go stale on refresh/delete)."""
+    st.session_state.gallery_page = 0
+    st.session_state.gallery_cursors = [None]  # Last DocID of the previous page, per page
+
+# --- CHART BUILDING ---
+@st.cache_data(ttl=30, max_entries=4, show_spinner=False)  # A few recent snapshots, expiring with load_data
+def build_charts(chart_df):
+    """Build the status pie and timeline histogram; rebuilt only when the data changes."""
+    fig = px.pie(chart_df, names='Status', title='Intruder vs Authorized Access Ratio', color='Status',
+                 color_discrete_map={'Intruder':'red', 'Authorized':'green'})
+    fig2 = px.histogram(chart_df, x="Time", color="Status", nbins=20, title="Events over Time",
+                        color_discrete_map={'Intruder':'red', 'Authorized':'green'})
+    return fig, fig2
 
 # --- DELETE FUNCTION ---
-def delete_log(doc_id):
-    """Delete a specific log entry from Firestore."""
+def clear_log_selection():
+    """Drop Delete ticks held by the logs editor (they are stored by row position)."""
+    for key in [k for k in st.session_state if str(k).startswith("logs_")]:
+        del st.session_state[key]
+
+def delete_logs(doc_ids):
+    """Delete the selected log entries from Firestore."""
     try:
-        db.collection(COLLECTION_NAME).document(doc_id).delete()
-        st.success("✅ Log deleted successfully!")
+        # One commit per BATCH_LIMIT deletes instead of one round-trip each
+        for i in range(0, len(doc_ids), BATCH_LIMIT):
+            batch = db.batch()
+            for doc_id in doc_ids[i:i + BATCH_LIMIT]:
+                batch.delete(db.collection(COLLECTION_NAME).document(doc_id))
+            batch.commit()
+        st.success(f"✅ {len(doc_ids)} log(s) deleted successfully!")
         st.cache_data.clear()
+        reset_gallery()
+        clear_log_selection()
         st.rerun()
     except Exception as e:
         st.error(f"❌ Error deleting log: {e}")
@@ -115,6 +207,8 @@ def delete_log(doc_id):
 # Auto-refresh button
 if st.button('🔄 Refresh Data'):
     st.cache_data.clear()
+    reset_gallery()
+    clear_log_selection()
 
 df = load_data()
 
@@ -122,9 +216,10 @@ if not df.empty:
     # --- METRICS ---
     col1, col2, col3 = st.columns(3)
     
+    status_counts = df["Status"].value_counts()
     total_detections = len(df)
-    intruder_count = len(df[df["Status"] == "Intruder"])
-    authorized_count = len(df[df["Status"] == "Authorized"])
+    intruder_count = int(status_counts.get("Intruder", 0))
+    authorized_count = int(status_counts.get("Authorized", 0))
     
     col1.metric("Total Events", total_detections)
     col2.metric("🚨 Intruders Detected", intruder_count, delta_color="inverse")
@@ -134,101 +229,43 @@ if not df.empty:
 
     # --- CHARTS ---
     c1, c2 = st.columns(2)
+    # Pass only the plotted columns so the cache key is cheap to hash
+    fig, fig2 = build_charts(df[["Time", "Status"]])
     
     with c1:
         st.subheader("Activity Overview")
-        fig = px.pie(df, names='Status', title='Intruder vs Authorized Access Ratio', color='Status',
-                     color_discrete_map={'Intruder':'red', 'Authorized':'green'})
         st.plotly_chart(fig, use_container_width=True)
 
     with c2:
         st.subheader("Recent Timeline")
-        # Ensure time is datetime for plotting
-        df["Time"] = pd.to_datetime(df["Time"])
-        fig2 = px.histogram(df, x="Time", color="Status", nbins=20, title="Events over Time",
-                            color_discrete_map={'Intruder':'red', 'Authorized':'green'})
         st.plotly_chart(fig2, use_container_width=True)
 
     # --- LOGS TABLE ---
     st.subheader("📝 Activity Logs")
     
-    # Add column headers with minimal spacing
-    header_col1, header_col2, header_col3, header_col4, header_col5 = st.columns([2, 2, 2, 3, 1])
-    with header_col1:
-        st.markdown("**Time**")
-    with header_col2:
-        st.markdown("**Name**")
-    with header_col3:
-        st.markdown("**Status**")
-    with header_col4:
-        st.markdown("**Image**")
-    with header_col5:
-        st.markdown("**Action**")
+    # Single editable table instead of one row of widgets per log; only the
+    # Delete checkbox is editable and DocID stays hidden for deletion
+    logs_df = df.assign(Time=df["Time"].astype(str), Delete=False)
+    edited = st.data_editor(
+        logs_df,
+        column_config={
+            "Image": st.column_config.LinkColumn("Image", display_text="View Image"),
+            "Delete": st.column_config.CheckboxColumn("Delete", help="Select logs to delete"),
+            "DocID": None
+        },
+        column_order=["Time", "Name", "Status", "Image", "Delete"],
+        disabled=["Time", "Name", "Status", "Image"],
+        hide_index=True,
+        num_rows="fixed",
+        use_container_width=True,
+        height=500,
+        # Keyed by the rows shown, so ticks never carry over onto shifted logs
+        key=f"logs_{hash(tuple(df['DocID']))}"
+    )
     
-    # Thin divider with reduced spacing
-    st.markdown("<hr style='margin: 8px 0 8px 0; border: none; border-top: 1px solid rgba(250, 250, 250, 0.2);'>", unsafe_allow_html=True)
-    
-    # Create scrollable container for logs with fixed height (500px)
-    # Using st.container with height parameter (Streamlit 1.32+)
-    try:
-        # Try using height parameter if available (Streamlit 1.32.0+)
-        with st.container(height=500):
-            # Create expandable rows with delete buttons for each log
-            for idx, row in df.iterrows():
-                col1, col2, col3, col4, col5 = st.columns([2, 2, 2, 3, 1])
-                
-                with col1:
-                    st.text(str(row['Time']))
-                with col2:
-                    st.text(row['Name'])
-                with col3:
-                    # Color-coded status
-                    if row['Status'] == 'Intruder':
-                        st.markdown(f"🚨 **{row['Status']}**")
-                    else:
-                        st.markdown(f"✅ **{row['Status']}**")
-                with col4:
-                    if row['Image']:
-                        st.markdown(f"[View Image]({row['Image']})")
-                    else:
-                        st.text("No Image")
-                with col5:
-                    # Delete button for each log
-                    if st.button("Delete", key=f"delete_{row['DocID']}", help="Delete this log", type="primary", 
-                                 kwargs={"style": "background-color:#d9534f;color:white;border:none;"} if hasattr(st, "button") else None):
-                        delete_log(row['DocID'])
-                
-                # Add subtle divider between rows
-                if idx < len(df) - 1:
-                    st.markdown("<hr style='margin: 5px 0; opacity: 0.3;'>", unsafe_allow_html=True)
-    except TypeError:
-        # Fallback for older Streamlit versions - just display all logs
-        for idx, row in df.iterrows():
-            col1, col2, col3, col4, col5 = st.columns([2, 2, 2, 3, 1])
-            
-            with col1:
-                st.text(str(row['Time']))
-            with col2:
-                st.text(row['Name'])
-            with col3:
-                # Color-coded status
-                if row['Status'] == 'Intruder':
-                    st.markdown(f"🚨 **{row['Status']}**")
-                else:
-                    st.markdown(f"✅ **{row['Status']}**")
-            with col4:
-                if row['Image']:
-                    st.markdown(f"[View Image]({row['Image']})")
-                else:
-                    st.text("No Image")
-            with col5:
-                # Delete button for each log
-                if st.button("Delete", key=f"delete_{row['DocID']}", help="Delete this log"):
-                    delete_log(row['DocID'])
-            
-                # Add subtle divider between rows
-                if idx < len(df) - 1:
-                    st.markdown("<hr style='margin: 5px 0; opacity: 0.3;'>", unsafe_allow_html=True)
+    selected_ids = edited.loc[edited["Delete"], "DocID"].tolist()
+    if st.button(f"Delete Selected ({len(selected_ids)})", type="primary", disabled=not selected_ids):
+        delete_logs(selected_ids)
 
     # Large spacing between Activity Logs and Gallery sections
     st.markdown("<br><br>", unsafe_allow_html=True)
@@ -237,17 +274,33 @@ if not df.empty:
     st.subheader("🚨 Intruder Evidence Gallery")
     st.caption("Tip: Delete logs from Activity Logs section will also remove images from this gallery")
     st.markdown("")  # Minimal spacing before gallery content
-    intruders = df[df["Status"] == "Intruder"]
+    total_intruders = load_intruder_count()
+    intruders = None
+    if total_intruders is None:
+        # Composite index not created yet: page through the loaded logs instead
+        intruders = df[df["Status"] == "Intruder"]
+        total_intruders = len(intruders)
     
-    if not intruders.empty:
+    if total_intruders:
         # Pagination settings
         images_per_page = 8
-        total_intruders = len(intruders)
         total_pages = (total_intruders + images_per_page - 1) // images_per_page  # Ceiling division
         
-        # Initialize session state for page number
-        if 'gallery_page' not in st.session_state:
-            st.session_state.gallery_page = 0
+        # Initialize session state for page number and Firestore cursors
+        if 'gallery_page' not in st.session_state or 'gallery_cursors' not in st.session_state:
+            reset_gallery()
+        
+        if intruders is None:
+            # Fetch only the current page from Firestore (cursor pagination)
+            page_df = load_intruder_page(st.session_state.gallery_cursors[st.session_state.gallery_page], images_per_page)
+            if page_df is None:
+                # Cursor log was deleted elsewhere (another tab/admin); restart from page 1
+                reset_gallery()
+                st.rerun()
+        else:
+            page_start = st.session_state.gallery_page * images_per_page
+            page_df = intruders.iloc[page_start:page_start + images_per_page]
+        has_next = (st.session_state.gallery_page < total_pages - 1) and len(page_df) == images_per_page
         
         # Navigation controls
         nav_col1, nav_col2, nav_col3 = st.columns([1, 2, 1])
@@ -261,7 +314,10 @@ if not df.empty:
             st.markdown(f"<h4 style='text-align: center;'>Page {st.session_state.gallery_page + 1} of {total_pages}</h4>", unsafe_allow_html=True)
         
         with nav_col3:
-            if st.button("Next ->", disabled=(st.session_state.gallery_page >= total_pages - 1), use_container_width=True):
+            if st.button("Next ->", disabled=not has_next, use_container_width=True):
+                cursors = st.session_state.gallery_cursors
+                if intruders is None and len(cursors) == st.session_state.gallery_page + 1:
+                    cursors.append(page_df["DocID"].iloc[-1])
                 st.session_state.gallery_page += 1
                 st.rerun()
         
@@ -270,10 +326,10 @@ if not df.empty:
         
         # Calculate start and end indices for current page
         start_idx = st.session_state.gallery_page * images_per_page
-        end_idx = min(start_idx + images_per_page, total_intruders)
+        end_idx = start_idx + len(page_df)
         
         # Get intruders for current page
-        intruder_list = list(intruders.iloc[start_idx:end_idx].itertuples())
+        intruder_list = list(page_df.itertuples())
         
         # Display images in grid (2 rows of 4)
         for row_num in range(0, len(intruder_list), 4):
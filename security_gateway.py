@@ -7,6 +7,11 @@ import serial
 import serial.tools.list_ports
 import numpy as np
 import re
+import hashlib
+import pickle
+import atexit
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 # Cloud Libraries
 import firebase_admin
@@ -16,6 +21,8 @@ from firebase_admin import credentials, firestore, storage
 SERIAL_PORT = "COM7"
 BAUD_RATE = 9600
 KNOWN_FACES_DIR = "known_faces"
+KNOWN_FACES_CACHE = "known_faces.pkl"  # Encodings cached between runs
+PARALLEL_ENCODE_MIN_IMAGES = 8  # Below this, spawning workers costs more than it saves
 INTRUDERS_DIR = "intruders"
 GCP_KEY_PATH = "serviceAccountKey.json"
 BUCKET_NAME = "intruder-detection-image"
@@ -23,6 +30,8 @@ COLLECTION_NAME = "security_logs"
 
 TOLERANCE = 0.5
 MODEL = "hog"
+TRAILING_DIGITS = re.compile(r'\d+$')  # Strips "Name1", "Name2" suffixes from file names
+DETECTION_SCALE = 0.5  # Detect on a downscaled frame; HOG cost scales with pixel count
 
 # Camera Preview Settings
 PREVIEW_DURATION_SECONDS = 2  # How long to show preview before capturing
@@ -32,6 +41,7 @@ SHOW_CAPTURED_RESULT = True  # Show the result with detection boxes
 db = None
 bucket = None
 ser = None
+io_pool = ThreadPoolExecutor(max_workers=2)  # Cloud uploads/logging off the camera path
 
 # --- INITIALIZATION FUNCTIONS ---
 
@@ -105,69 +115,133 @@ def upload_image_to_bucket(local_path):
         print(f"[ERROR] Upload failed: {e}")
         return "Upload Failed"
 
-def log_event_to_firestore(name, status, image_url=None):
-    """Logs the security event to Firestore."""
-    if not db:
+def log_events_to_firestore(events):
+    """Logs (name, status, image_url) security events to Firestore in one batched write."""
+    if not db or not events:
         return
 
-    data = {
-        "timestamp": firestore.SERVER_TIMESTAMP,
-        "datetime_str": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "unix_timestamp": time.time(),
-        "name": name,
-        "status": status,
-        "device": "Laptop_Gateway"
-    }
-    if image_url:
-        data["image_url"] = image_url
+    batch = db.batch()
+    for name, status, image_url in events:
+        data = {
+            "timestamp": firestore.SERVER_TIMESTAMP,
+            "datetime_str": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "unix_timestamp": time.time(),
+            "name": name,
+            "status": status,
+            "device": "Laptop_Gateway"
+        }
+        if image_url:
+            data["image_url"] = image_url
+        batch.set(db.collection(COLLECTION_NAME).document(), data)
 
     try:
-        db.collection(COLLECTION_NAME).add(data)
-        print(f"[CLOUD] Event logged to Firestore: {status} - {name}")
+        batch.commit()
+        for name, status, _ in events:
+            print(f"[CLOUD] Event logged to Firestore: {status} - {name}")
     except Exception as e:
         print(f"[ERROR] Firestore log failed: {e}")
 
+def upload_and_log(local_path, log_entries):
+    """Uploads the evidence image (if any), then logs every face seen with one commit (runs in io_pool)."""
+    url = upload_image_to_bucket(local_path) if local_path else None
+    events = [
+        (name, status, None) if status == "Authorized" else ("Unknown", "Intruder", url)
+        for name, status in log_entries
+    ]
+    log_events_to_firestore(events)
+
 # --- CORE LOGIC ---
 
+def known_faces_key(directory):
+    """Fingerprint of the face images (name + mtime) to detect a stale cache."""
+    entries = sorted(
+        (filename, os.path.getmtime(os.path.join(directory, filename)))
+        for filename in os.listdir(directory)
+    )
+    return hashlib.sha256(repr(entries).encode()).hexdigest()
+
+def encode_known_face(path):
+    """Returns (path, encoding) for the first face in the image, or (path, None).
+    Runs in a worker process, so it must stay a top-level function."""
+    try:
+        img = cv2.imread(path)
+        if img is None:
+            return path, None
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        face_encs = face_recognition.face_encodings(rgb)
+        return path, (face_encs[0] if face_encs else None)
+    except Exception:
+        return path, None
+
 def load_known_faces(directory):
     # Reusing the robust logic from Phase 1
     encodings = []
     names = []
     if not os.path.exists(directory):
         os.makedirs(directory)
-        return [], []
+        return np.empty((0, 128), dtype=np.float32), []
 
-    for filename in os.listdir(directory):
-        if filename.lower().endswith(('.jpg', '.png', '.jpeg')):
-            path = os.path.join(directory, filename)
-            try:
-                img = cv2.imread(path)
-                if img is None: continue
-                rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB).astype('uint8')
-                face_encs = face_recognition.face_encodings(rgb)
-                if face_encs:
-                    encodings.append(face_encs[0])
-                    # Name Parsing - Remove numerical suffixes
-                    basename = os.path.splitext(filename)[0]
-                    
-                    # First, handle underscore-separated suffixes (e.g., Name_1, Name_2)
-                    if "_" in basename:
-                         name_part = basename.rsplit('_', 1)[0]
-                         suffix = basename.rsplit('_', 1)[1]
-                         if suffix.isdigit() or len(suffix) < 3:
-                             final_name = name_part
-                         else:
-                             final_name = basename
-                    else:
-                        final_name = basename
-                    
-                    # Second, strip trailing digits directly appended to name (e.g., Name1, Name2, Name3)
-                    # Remove all trailing digits from the name
-                    final_name = re.sub(r'\d+$', '', final_name).strip()
-                    
-                    names.append(final_name.title())
-            except:
-                pass
+    # Skip re-encoding when the images haven't changed since the last run
+    key = known_faces_key(directory)
+    if os.path.exists(KNOWN_FACES_CACHE):
+        try:
+            with open(KNOWN_FACES_CACHE, "rb") as f:
+                cached_encodings, cached_names, cached_key = pickle.load(f)
+            if cached_key == key:
+                print("[INFO] Loaded face encodings from cache.")
+                return np.asarray(cached_encodings, dtype=np.float32), cached_names
+        except Exception as e:
+            print(f"[WARNING] Ignoring unreadable face cache: {e}")
+
+    # Encode images in parallel (CPU-bound dlib work) once there are enough of them;
+    # spawned workers re-import cv2/dlib/firebase, so small sets stay serial
+    filenames = [f for f in os.listdir(directory) if f.lower().endswith(('.jpg', '.png', '.jpeg'))]
+    paths = [os.path.join(directory, f) for f in filenames]
+    results = None
+    if len(paths) >= PARALLEL_ENCODE_MIN_IMAGES:
+        try:
+            with ProcessPoolExecutor(max_workers=min(len(paths), os.cpu_count() or 1)) as executor:
+                results = list(executor.map(encode_known_face, paths))
+        except BrokenProcessPool as e:
+            print(f"[WARNING] Parallel face encoding failed ({e}); encoding serially.")
+    if results is None:
+        results = [encode_known_face(path) for path in paths]
+
+    for filename, (_, encoding) in zip(filenames, results):
+        if encoding is not None:
+            encodings.append(encoding)
+            # Name Parsing - Remove numerical suffixes
+            basename = os.path.splitext(filename)[0]
+            
+            # First, handle underscore-separated suffixes (e.g., Name_1, Name_2)
+            if "_" in basename:
+                 name_part = basename.rsplit('_', 1)[0]
+                 suffix = basename.rsplit('_', 1)[1]
+                 if suffix.isdigit() or len(suffix) < 3:
+                     final_name = name_part
+                 else:
+                     final_name = basename
+            else:
+                final_name = basename
+            
+            # Second, strip trailing digits directly appended to name (e.g., Name1, Name2, Name3)
+            # Remove all trailing digits from the name
+            final_name = TRAILING_DIGITS.sub('', final_name).strip()
+            
+            names.append(final_name.title())
+
+    # Stack once into a contiguous (K, 128) float32 matrix for vectorized distance
+    # checks; float32 halves memory traffic with no practical loss in accuracy
+    if encodings:
+        encodings = np.ascontiguousarray(np.vstack(encodings), dtype=np.float32)
+    else:
+        encodings = np.empty((0, 128), dtype=np.float32)
+
+    try:
+        with open(KNOWN_FACES_CACHE, "wb") as f:
+            pickle.dump((encodings, names, key), f)
+    except Exception as e:
+        print(f"[WARNING] Could not write face cache: {e}")
     return encodings, names
 
 def process_camera(known_encodings, known_names):
@@ -194,24 +268,25 @@ def process_camera(known_encodings, known_names):
     print("[INFO] ✅ Camera Connected Successfully!")
     
     # Warmup: Discard first 3 frames (often dark/slow from camera startup)
+    # grab() advances the stream without decoding the frames we throw away
     for _ in range(3):
-        cap.read()
+        cap.grab()
     
     print("[INFO] Showing preview... Position yourself in frame.")
     print(f"[INFO] Capture will happen in {PREVIEW_DURATION_SECONDS} seconds...")
     
-    # Show live preview to let user position themselves
-    preview_frames = PREVIEW_DURATION_SECONDS * 20  # 20 fps preview
+    # Show live preview to let user position themselves (timed by wall clock)
     frame = None
+    start_time = time.monotonic()
     
-    for i in range(preview_frames):
+    while (elapsed := time.monotonic() - start_time) < PREVIEW_DURATION_SECONDS:
         ret, temp_frame = cap.read()
         if ret:
             frame = temp_frame
             
             # Add text overlay showing countdown
             display_frame = frame.copy()
-            seconds_left = PREVIEW_DURATION_SECONDS - (i // 20)
+            seconds_left = PREVIEW_DURATION_SECONDS - int(elapsed)
             if seconds_left > 0:
                 text = f"Get Ready! Capturing in {seconds_left}..."
                 color = (0, 255, 255)  # Yellow
@@ -226,8 +301,7 @@ def process_camera(known_encodings, known_names):
             
             # Show preview window
             cv2.imshow('Security Check - Camera Preview', display_frame)
-            cv2.waitKey(1)
-        time.sleep(0.05)
+        cv2.waitKey(50)  # Paces the preview (~20 fps) while servicing the GUI
     
     print("[INFO] 📸 Capturing frame for analysis...")
 
@@ -239,8 +313,11 @@ def process_camera(known_encodings, known_names):
 
     # Process Frame
     print("[INFO] Processing face detection...")
-    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB).astype('uint8')
-    face_locs = face_recognition.face_locations(rgb_frame, model=MODEL)
+    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    small_frame = cv2.resize(rgb_frame, (0, 0), fx=DETECTION_SCALE, fy=DETECTION_SCALE)
+    small_locs = face_recognition.face_locations(small_frame, model=MODEL)
+    # Scale boxes back up; encodings still use the full-res frame for accuracy
+    face_locs = [tuple(int(v / DETECTION_SCALE) for v in loc) for loc in small_locs]
     face_encs = face_recognition.face_encodings(rgb_frame, face_locs)
 
     if not face_locs:
@@ -256,29 +333,38 @@ def process_camera(known_encodings, known_names):
     any_intruder_detected = False
     log_entries = [] # To store logs (Name, Status)
 
+    # Check matches for every face at once (Best Match Logic)
+    # Squared euclidean distance matrix (K known x F faces); skips the sqrt,
+    # so it is compared against TOLERANCE**2
+    encs = np.asarray(face_encs, dtype=np.float32)
+    diffs = known_encodings[:, None, :] - encs[None, :, :]
+    distances = np.einsum('kfd,kfd->kf', diffs, diffs)
+    if len(known_encodings) > 0:
+        best_indices = distances.argmin(axis=0)
+        matched = distances.min(axis=0) < TOLERANCE ** 2
+    else:
+        best_indices = np.zeros(len(face_encs), dtype=int)
+        matched = np.zeros(len(face_encs), dtype=bool)
+
     # LOOP through all faces found
-    for (top, right, bottom, left), encoding in zip(face_locs, face_encs):
+    for (top, right, bottom, left), best_idx, is_match in zip(face_locs, best_indices, matched):
         person_name = "Unknown"
         is_intruder_face = True
         
-        # Check matches (Best Match Logic)
-        distances = face_recognition.face_distance(known_encodings, encoding)
-        if len(distances) > 0:
-            best_idx = np.argmin(distances)
-            if distances[best_idx] < TOLERANCE:
-                detected_name = known_names[best_idx]
-                
-                # --- NEW REQUIREMENT: Logic Aggregation ---
-                # Only Authorize specific names
-                AUTHORIZED_NAMES = ["Yeo Din Song", "Lim Yong Jun"]
-                
-                # Check partial match just in case of slight variations (case insensitive)
-                if any(auth_name.lower() in detected_name.lower() for auth_name in AUTHORIZED_NAMES):
-                    person_name = detected_name
-                    is_intruder_face = False
-                else:
-                    person_name = detected_name + " (Unauthorized)"
-                    is_intruder_face = True
+        if is_match:
+            detected_name = known_names[best_idx]
+            
+            # --- NEW REQUIREMENT: Logic Aggregation ---
+            # Only Authorize specific names
+            AUTHORIZED_NAMES = ["Yeo Din Song", "Lim Yong Jun"]
+            
+            # Check partial match just in case of slight variations (case insensitive)
+            if any(auth_name.lower() in detected_name.lower() for auth_name in AUTHORIZED_NAMES):
+                person_name = detected_name
+                is_intruder_face = False
+            else:
+                person_name = detected_name + " (Unauthorized)"
+                is_intruder_face = True
         
         # Logic Aggregation
         if is_intruder_face:
@@ -305,14 +391,14 @@ def process_camera(known_encodings, known_names):
     for name, status in log_entries:
          if status == "Authorized":
              print(f"✅ Welcome, {name}!")
-             log_event_to_firestore(name, "Authorized")
              authorized_detected = True
-         # We delay logging intruders until we decide if we need to save the image
+         # Logging is deferred so everyone is written in one batch after the image upload
     
     # 2. Play welcome beep for authorized users (only if NO intruders present)
     if authorized_detected and not any_intruder_detected:
         trigger_welcome_beep()
 
+    local_path = None
     if any_intruder_detected:
         # Case B: At least one Intruder
         print("🚨 INTRUDER DETECTED! 🚨")
@@ -327,14 +413,9 @@ def process_camera(known_encodings, known_names):
         local_path = os.path.join(INTRUDERS_DIR, img_name)
         cv2.imwrite(local_path, frame)
         print(f"[EVIDENCE] Saved to {local_path}")
-        
-        # 3. Cloud Upload
-        url = upload_image_to_bucket(local_path)
-        
-        # 4. Log the Intruders (with image)
-        for name, status in log_entries:
-            if status == "Intruder":
-                 log_event_to_firestore("Unknown", "Intruder", url)
+
+    # 3. Cloud Upload + Log everyone (intruders with image) in one batch, in the background
+    io_pool.submit(upload_and_log, local_path, log_entries)
 
     cap.release()
     cv2.destroyAllWindows()
@@ -346,6 +427,7 @@ def main():
     print("--- SMART SECURITY GATEWAY STARTED ---")
     
     # Setup
+    atexit.register(io_pool.shutdown, wait=True)  # Let pending uploads finish on exit
     initialize_gcp()
     initialize_serial()
     